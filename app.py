@@ -2,11 +2,22 @@ import streamlit as st
 from nselib import derivatives
 import pandas as pd
 import logging
+import io
+import zipfile
+import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date, timedelta
-import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
 import numpy as np
 
+from utils import calculate_gini
+
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 
@@ -76,6 +87,148 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+REQUIRED_COLS = ['TckrSymb', 'OptnTp', 'TtlTradgVol', 'SttlmPric', 'NewBrdLotQty']
+REQUIRED_DTYPES = {
+    'TckrSymb': 'category',
+    'OptnTp': 'category',
+    'TtlTradgVol': 'float32',
+    'SttlmPric': 'float32',
+    'NewBrdLotQty': 'uint32'
+}
+
+class BhavCopyUnavailableError(Exception):
+    """Raised when the bhav copy for a date is empty or missing expected columns"""
+
+# NSE UDiFF F&O bhav copy archive (the same file nselib downloads)
+FO_BHAV_COPY_URL = "https://nsearchives.nseindia.com/content/fo/BhavCopy_NSE_FO_0_0_0_{trade_date}_F_0000.csv.zip"
+
+def _read_bhav_copy_csv(formatted_date: str) -> pd.DataFrame:
+    """Download the F&O bhav copy and parse only the columns we use"""
+    trade_date = datetime.strptime(formatted_date, "%d-%m-%Y").strftime("%Y%m%d")
+    response = requests.get(
+        FO_BHAV_COPY_URL.format(trade_date=trade_date),
+        headers={'User-Agent': 'Mozilla/5.0'},
+        timeout=30
+    )
+    response.raise_for_status()
+    
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        with archive.open(archive.namelist()[0]) as csv_file:
+            return pd.read_csv(csv_file, usecols=REQUIRED_COLS, dtype=REQUIRED_DTYPES, engine='pyarrow')
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _fetch_raw(formatted_date: str) -> pd.DataFrame:
+    """Fetch the F&O bhav copy for a date, trimmed to the columns we use"""
+    try:
+        data = _read_bhav_copy_csv(formatted_date)
+    except Exception as e:
+        # A 404 means NSE has no file for the date (holiday or not yet published);
+        # nselib would only request the same URL again
+        if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code == 404:
+            raise BhavCopyUnavailableError(formatted_date) from e
+        
+        # Older archive formats, schema changes, blocked requests or a missing pyarrow fall back to nselib
+        logging.info(f"Direct bhav copy read failed for {formatted_date} ({e}), falling back to nselib")
+        data = derivatives.fno_bhav_copy(formatted_date)
+    
+    # Check if expected columns exist; raising keeps st.cache_data from storing the miss,
+    # so a file NSE publishes later is picked up on the next fetch
+    if data.empty or not set(REQUIRED_COLS).issubset(data.columns):
+        raise BhavCopyUnavailableError(formatted_date)
+    
+    # Categorical symbols/option types let isin and groupby work on integer codes
+    data = data[REQUIRED_COLS].astype({'TckrSymb': 'category', 'OptnTp': 'category'})
+    
+    # Downcast numerics to halve the bytes pushed through the premium pipeline
+    bytes_before = data.memory_usage(deep=True).sum()
+    for col in ('TtlTradgVol', 'SttlmPric'):
+        data[col] = pd.to_numeric(data[col], downcast='float')
+    data['NewBrdLotQty'] = pd.to_numeric(data['NewBrdLotQty'], downcast='unsigned')
+    bytes_after = data.memory_usage(deep=True).sum()
+    logging.info(f"Bhav copy {formatted_date}: {bytes_before / 1e6:.1f} MB -> {bytes_after / 1e6:.1f} MB after downcast")
+    
+    return data
+
+def _sum_premium_polars(data):
+    """Filter, multiply and group-sum in a single Polars lazy query"""
+    return (
+        pl.from_pandas(data).lazy()
+        .filter(pl.col('OptnTp').is_in(['PE', 'CE']) & pl.col('TckrSymb').is_not_null())
+        .with_columns(
+            (pl.col('TtlTradgVol').cast(pl.Float64) * pl.col('SttlmPric') * pl.col('NewBrdLotQty')).alias('Premium')
+        )
+        .group_by('TckrSymb')
+        .agg(pl.col('Premium').sum())
+        .sort('Premium', descending=True)
+        .collect()
+        .to_pandas()
+    )
+
+def _sum_premium_pandas(data):
+    """Filter, multiply and group-sum with pandas/NumPy"""
+    # Filter for PE and CE options, keeping only the columns the premium needs
+    filtered_data = data.loc[
+        data['OptnTp'].isin(['PE', 'CE']),
+        ['TckrSymb', 'TtlTradgVol', 'SttlmPric', 'NewBrdLotQty']
+    ]
+    
+    # Calculate Premium Traded (assign returns a new frame, so no defensive copy);
+    # volume is widened to float64 so the product and later sums don't lose precision
+    filtered_data = filtered_data.assign(
+        Premium=lambda d: d['TtlTradgVol'].astype(np.float64) * d['SttlmPric'] * d['NewBrdLotQty']
+    )
+    
+    # Group by ticker symbol via a dense bincount over the category codes
+    symbols = filtered_data['TckrSymb']
+    codes = symbols.cat.codes.to_numpy()
+    premium = filtered_data['Premium'].to_numpy(dtype=np.float64, na_value=0.0)
+    valid = codes >= 0
+    codes, premium = codes[valid], premium[valid]
+    n_cats = len(symbols.cat.categories)
+    sums = np.bincount(codes, weights=premium, minlength=n_cats)
+    observed = np.bincount(codes, minlength=n_cats) > 0
+    grouped_data = pd.DataFrame({
+        'TckrSymb': symbols.cat.categories[observed],
+        'Premium': sums[observed]
+    })
+    return grouped_data.sort_values(by='Premium', ascending=False)
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _compute_premium(formatted_date: str, _data: pd.DataFrame) -> pd.DataFrame:
+    """Aggregate premium traded per symbol (cached per date)"""
+    if pl is not None:
+        grouped_data = _sum_premium_polars(_data)
+    else:
+        grouped_data = _sum_premium_pandas(_data)
+    
+    grouped_data['Premium Traded (Crores)'] = grouped_data['Premium'] / 10_000_000
+    
+    # Keep symbols categorical so symbol search can scan the categories only
+    grouped_data['TckrSymb'] = grouped_data['TckrSymb'].astype('category')
+    
+    return grouped_data[['TckrSymb', 'Premium Traded (Crores)']]
+
+@st.cache_resource
+def _get_executor():
+    """Shared worker pool for background bhav copy fetches"""
+    return ThreadPoolExecutor(max_workers=2)
+
+def prefetch_bhav_copy(selected_date):
+    """Start fetching the bhav copy for a date in the background as soon as it is picked"""
+    try:
+        formatted_date = selected_date.strftime("%d-%m-%Y")
+    except Exception:
+        return
+    
+    if st.session_state.get('prefetch_date') != formatted_date:
+        # Drop a still-queued download for the previous date so it doesn't hold a worker
+        previous = st.session_state.get('prefetch_future')
+        if previous is not None:
+            previous.cancel()
+        
+        st.session_state.prefetch_date = formatted_date
+        st.session_state.prefetch_future = _get_executor().submit(_fetch_raw, formatted_date)
+
 def get_premium_traded_data(selected_date):
     """
     Extract the core logic from your Flask route and adapt it for Streamlit
@@ -88,64 +241,54 @@ def get_premium_traded_data(selected_date):
         return None
     
     try:
-        # Fetch data using nselib
-        data = derivatives.fno_bhav_copy(formatted_date)
-        
-        # Check if expected columns exist
-        required_cols = {'OptnTp', 'TtlTradgVol', 'SttlmPric', 'NewBrdLotQty', 'TckrSymb'}
-        if data.empty or not required_cols.issubset(data.columns):
-            st.warning(f"Data not available or missing columns for date {formatted_date}")
-            return None
-        
-        # Filter for PE and CE options
-        filtered_data = data[data['OptnTp'].isin(['PE', 'CE'])]
-        
-        # Calculate Premium Traded
-        filtered_data = filtered_data.copy()
-        filtered_data['Premium Traded'] = (
-            filtered_data['TtlTradgVol'] * filtered_data['SttlmPric'] * filtered_data['NewBrdLotQty']
-        )
-        
-        # Group by ticker symbol and sum premium traded
-        grouped_data = filtered_data.groupby('TckrSymb')['Premium Traded'].sum().reset_index()
-        grouped_data = grouped_data.sort_values(by='Premium Traded', ascending=False)
-        grouped_data['Premium Traded (Crores)'] = grouped_data['Premium Traded'] / 10_000_000
-        
-        return grouped_data[['TckrSymb', 'Premium Traded (Crores)']]
-        
+        # Fetch data using nselib (cached per date), joining an in-flight prefetch if any
+        # Keep prefetch_date so the loaded date isn't prefetched again on the next rerun
+        future = None
+        if st.session_state.get('prefetch_date') == formatted_date:
+            future = st.session_state.pop('prefetch_future', None)
+        
+        # Only join a prefetch that has started; a queued one may sit behind other sessions' downloads
+        if future is not None and not future.cancelled() and (future.running() or future.done()):
+            data = future.result()
+        else:
+            if future is not None:
+                future.cancel()
+            data = _fetch_raw(formatted_date)
+        
+        return _compute_premium(formatted_date, data)
+        
+    except BhavCopyUnavailableError:
+        st.warning(f"Data not available or missing columns for date {formatted_date}")
+        return None
     except Exception as e:
         st.error(f"Error fetching data: {e}")
         return None
 
-def create_advanced_metrics(data):
+@st.cache_data(show_spinner=False)
+def create_advanced_metrics(data_key, _data):
     """Create advanced analytical metrics"""
+    data = _data
     if data.empty:
         return {}
     
-    total_premium = data['Premium Traded (Crores)'].sum()
-    top_5_premium = data.head(5)['Premium Traded (Crores)'].sum()
+    # Pull the column out once and reduce on the array (data is sorted by premium)
+    values = data['Premium Traded (Crores)'].to_numpy(dtype=np.float64)
+    total_premium = values.sum()
+    top_5_premium = values[:5].sum()
     concentration_ratio = (top_5_premium / total_premium) * 100 if total_premium > 0 else 0
     
     return {
         'total_premium': total_premium,
-        'avg_premium': data['Premium Traded (Crores)'].mean(),
-        'median_premium': data['Premium Traded (Crores)'].median(),
+        'avg_premium': total_premium / values.size,
+        'median_premium': np.median(values),
         'concentration_ratio': concentration_ratio,
-        'gini_coefficient': calculate_gini(data['Premium Traded (Crores)'].values)
+        'gini_coefficient': calculate_gini(values)
     }
 
-def calculate_gini(values):
-    """Calculate Gini coefficient for concentration analysis"""
-    if len(values) == 0:
-        return 0
-    
-    sorted_values = np.sort(values)
-    n = len(values)
-    cumsum = np.cumsum(sorted_values)
-    return (n + 1 - 2 * np.sum(cumsum) / cumsum[-1]) / n if cumsum[-1] > 0 else 0
-
-def create_enhanced_visualizations(data):
-    """Create enhanced visualizations with better styling"""
+@st.cache_data(max_entries=32, show_spinner=False)
+def create_enhanced_visualizations(filter_key, _data):
+    """Create enhanced visualizations with better styling, returned as Plotly JSON"""
+    data = _data
     if data.empty:
         return None, None, None
     
@@ -210,15 +353,15 @@ def create_enhanced_visualizations(data):
     )
     
     # Concentration Analysis Chart
-    cumulative_data = data.copy()
-    cumulative_data['Cumulative Premium'] = cumulative_data['Premium Traded (Crores)'].cumsum()
-    cumulative_data['Cumulative %'] = (cumulative_data['Cumulative Premium'] / cumulative_data['Premium Traded (Crores)'].sum()) * 100
-    cumulative_data['Rank'] = range(1, len(cumulative_data) + 1)
+    values = data['Premium Traded (Crores)'].to_numpy()
+    cumulative = np.cumsum(values)
+    cumulative_pct = cumulative * (100.0 / cumulative[-1])
+    ranks = np.arange(1, values.size + 1, dtype=np.int32)
     
     fig_concentration = go.Figure()
     fig_concentration.add_trace(go.Scatter(
-        x=cumulative_data['Rank'][:20],
-        y=cumulative_data['Cumulative %'][:20],
+        x=ranks[:20],
+        y=cumulative_pct[:20],
         mode='lines+markers',
         name='Cumulative Premium %',
         line=dict(color='#667eea', width=3),
@@ -242,7 +385,51 @@ def create_enhanced_visualizations(data):
         showlegend=False
     )
     
-    return fig_bar, fig_pie, fig_concentration
+    # Cache the serialized figures so reruns skip rebuilding and validating traces
+    return fig_bar.to_json(), fig_pie.to_json(), fig_concentration.to_json()
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def filter_data(filter_key, _data):
+    """
+    Apply the Data Explorer search and premium range filters.
+    
+    Served by reference to the table, charts and exports, so treat the result as read-only.
+    """
+    _, search_term, min_premium, max_premium = filter_key
+    
+    filtered_data = _data
+    if search_term:
+        # Plain substring match over the (small) category list, mapped back via codes
+        symbols = filtered_data['TckrSymb']
+        matches = symbols.cat.categories.str.upper().str.contains(search_term.upper(), regex=False)
+        keep_codes = np.flatnonzero(matches)
+        filtered_data = filtered_data[symbols.cat.codes.isin(keep_codes)]
+    
+    filtered_data = filtered_data[
+        (filtered_data['Premium Traded (Crores)'] >= min_premium) & 
+        (filtered_data['Premium Traded (Crores)'] <= max_premium)
+    ]
+    
+    return filtered_data
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def export_csv(filter_key, _data):
+    """Serialize the filtered data to CSV"""
+    return _data.to_csv(index=False).encode()
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def export_excel(filter_key, _data):
+    """Serialize the filtered data to an Excel workbook"""
+    excel_buffer = io.BytesIO()
+    with pd.ExcelWriter(excel_buffer, engine='xlsxwriter') as writer:
+        _data.to_excel(writer, index=False, sheet_name='Premium Data')
+    
+    return excel_buffer.getvalue()
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def export_json(filter_key, _data):
+    """Serialize the filtered data to JSON records"""
+    return _data.to_json(orient='records').encode()
 
 def main():
     # Modern Header
@@ -289,6 +476,14 @@ def main():
         show_advanced_metrics = st.checkbox("Show Advanced Metrics", value=True)
         top_n = st.slider("Top N symbols to display", 5, 50, 10)
     
+    # Warm the cache for the picked date while the user is still on the controls
+    prefetch_bhav_copy(selected_date)
+    
+    if 'data' not in st.session_state and not fetch_clicked:
+        future = st.session_state.get('prefetch_future')
+        if future is not None and not future.done():
+            st.info(f"⏳ Preparing data for {selected_date.strftime('%d-%m-%Y')} in the background...")
+    
     # Fetch data
     if fetch_clicked:
         with st.spinner("🔄 Fetching data..."):
@@ -304,9 +499,10 @@ def main():
     # Display data if available
     if 'data' in st.session_state:
         data = st.session_state.data
+        data_key = st.session_state.selected_date
         
         # Enhanced Metrics Cards
-        metrics = create_advanced_metrics(data)
+        metrics = create_advanced_metrics(data_key, data)
         
         col1, col2, col3, col4 = st.columns(4)
         
@@ -380,29 +576,30 @@ def main():
         with col3:
             max_premium = st.number_input("Max Premium (Cr)", min_value=0.0, value=float(data['Premium Traded (Crores)'].max()), step=0.1)
         
-        # Apply filters
-        filtered_data = data.copy()
-        if search_term:
-            filtered_data = filtered_data[filtered_data['TckrSymb'].str.contains(search_term, case=False, na=False)]
-        
-        filtered_data = filtered_data[
-            (filtered_data['Premium Traded (Crores)'] >= min_premium) & 
-            (filtered_data['Premium Traded (Crores)'] <= max_premium)
-        ]
+        # Apply filters (cached per date + filter inputs so reruns skip recompute)
+        filter_key = (data_key, search_term, min_premium, max_premium)
+        filtered_data = filter_data(filter_key, data)
         
         # Enhanced Data Table
         st.markdown("#### 📋 Premium Traded Data")
         
-        # Add ranking column
-        filtered_data_display = filtered_data.copy()
-        filtered_data_display.insert(0, 'Rank', range(1, len(filtered_data_display) + 1))
-        filtered_data_display['Premium Traded (Crores)'] = filtered_data_display['Premium Traded (Crores)'].round(2)
+        # Data is already sorted by premium, so the top N rows are a plain head()
+        table_data = filtered_data.head(top_n)
         
+        # Add ranking column; formatting and the gradient bar are rendered client-side
+        max_display_premium = float(table_data['Premium Traded (Crores)'].max()) if not table_data.empty else 0.0
         st.dataframe(
-            filtered_data_display.style.format({
-                'Premium Traded (Crores)': '₹{:.2f}'
-            }).background_gradient(subset=['Premium Traded (Crores)'], cmap='Blues'),
-            use_container_width=True,
+            table_data.assign(Rank=np.arange(1, len(table_data) + 1)),
+            column_order=('Rank', 'TckrSymb', 'Premium Traded (Crores)'),
+            column_config={
+                'Premium Traded (Crores)': st.column_config.ProgressColumn(
+                    'Premium Traded (Crores)',
+                    format='₹%.2f',
+                    min_value=0.0,
+                    max_value=max(max_display_premium, 1e-9)
+                )
+            },
+            width='stretch',
             height=400
         )
         
@@ -410,20 +607,20 @@ def main():
         st.markdown("---")
         st.markdown("### 📊 Visual Analytics")
         
-        fig_bar, fig_pie, fig_concentration = create_enhanced_visualizations(filtered_data)
+        fig_bar, fig_pie, fig_concentration = create_enhanced_visualizations(filter_key, filtered_data)
         
         if fig_bar and fig_pie:
             col1, col2 = st.columns(2)
             
             with col1:
-                st.plotly_chart(fig_bar, use_container_width=True)
+                st.plotly_chart(pio.from_json(fig_bar), use_container_width=True)
             
             with col2:
-                st.plotly_chart(fig_pie, use_container_width=True)
+                st.plotly_chart(pio.from_json(fig_pie), use_container_width=True)
             
             # Concentration analysis
             if show_concentration and fig_concentration:
-                st.plotly_chart(fig_concentration, use_container_width=True)
+                st.plotly_chart(pio.from_json(fig_concentration), use_container_width=True)
         
         # Enhanced Download Section
         st.markdown("---")
@@ -432,36 +629,31 @@ def main():
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            csv = filtered_data.to_csv(index=False)
+            # Exports are callables so bytes are only built when a button is clicked
             st.download_button(
                 label="📄 Download CSV",
-                data=csv,
+                data=lambda: export_csv(filter_key, filtered_data),
                 file_name=f"premium_traded_{st.session_state.selected_date.strftime('%Y%m%d')}.csv",
                 mime="text/csv",
-                use_container_width=True
+                width='stretch'
             )
         
         with col2:
-            excel_buffer = pd.ExcelWriter('temp.xlsx', engine='openpyxl')
-            filtered_data.to_excel(excel_buffer, index=False, sheet_name='Premium Data')
-            excel_buffer.close()
-            
             st.download_button(
                 label="📊 Download Excel",
-                data=open('temp.xlsx', 'rb').read(),
+                data=lambda: export_excel(filter_key, filtered_data),
                 file_name=f"premium_traded_{st.session_state.selected_date.strftime('%Y%m%d')}.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                use_container_width=True
+                width='stretch'
             )
         
         with col3:
-            json_data = filtered_data.to_json(orient='records', indent=2)
             st.download_button(
                 label="🔗 Download JSON",
-                data=json_data,
+                data=lambda: export_json(filter_key, filtered_data),
                 file_name=f"premium_traded_{st.session_state.selected_date.strftime('%Y%m%d')}.json",
                 mime="application/json",
-                use_container_width=True
+                width='stretch'
             )
 
 if __name__ == "__main__":
@@ -0,0 +1,18 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from app import export_excel
+
+
+def test_export_excel_round_trips_every_cell():
+    data = pd.DataFrame({
+        'TckrSymb': [f"SYM{i}" for i in range(100)],
+        'Premium Traded (Crores)': np.arange(1, 101, dtype=np.float64) / 4
+    })
+    
+    excel_bytes = export_excel(('round-trip', '', 0.0, 100.0), data)
+    
+    result = pd.read_excel(io.BytesIO(excel_bytes), sheet_name='Premium Data', engine='openpyxl')
+    pd.testing.assert_frame_equal(result, data)
@@ -0,0 +1,25 @@
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+# Kept out of app.py: numba's disk cache is named after the defining module, and
+# the Streamlit entry script runs as __main__, not as an importable module
+@njit(cache=True, fastmath=True)
+def calculate_gini(values):
+    """Calculate Gini coefficient for concentration analysis"""
+    n = values.size
+    if n == 0:
+        return 0.0
+    
+    # Single pass over the sorted values: G = 2*sum(i*x_i) / (n*sum(x)) - (n+1)/n
+    sorted_values = np.sort(values)
+    weighted = 0.0
+    total = 0.0
+    for i in range(n):
+        weighted += (i + 1) * sorted_values[i]
+        total += sorted_values[i]
+    return (2.0 * weighted) / (n * total) - (n + 1.0) / n if total > 0 else 0.0